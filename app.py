@@ -1,27 +1,88 @@
 import streamlit as st
-import os
-from google import genai
-from google.genai import types
-from pydantic import BaseModel, ValidationError
+import hashlib
+import re
+import sqlite3
 import json
-from streamlit_extras.stylable_container import stylable_container
+import itertools
+import sys
+import threading
+import time
+from types import SimpleNamespace
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+# NOTE: google.genai, pydantic and streamlit_extras are imported lazily inside
+# the functions that need them — Streamlit re-executes this file top-to-bottom
+# on every rerun, and deferring those imports keeps first paint fast (and free
+# in mock mode).
 
 # --- 1. CONFIGURATION AND MOCK DATA ---
 
 # Gemini API Initialization (Uses st.secrets for key)
-try:
-    if "GEMINI_API_KEY" in st.secrets:
-        client = genai.Client(api_key=st.secrets["GEMINI_API_KEY"])
-    else:
-        # Client will be None if key is missing/empty
-        st.error("Gemini API key not found in `.streamlit/secrets.toml`. Please set it to run the LLM-based scoring.")
-        client = None
-except Exception as e:
-    st.error(f"Error initializing Gemini client: {e}")
-    client = None
+class _MockClient:
+    """Stands in for genai.Client when no API key is configured.
+
+    Exposes the same .models.generate_content / generate_content_stream
+    surface, so the LLM functions run without per-call None-checks and the
+    app stays usable (in low-detail mode) without a key.
+    """
+
+    is_mock = True
+
+    class _Models:
+        @staticmethod
+        def _mock_text(contents, config) -> str:
+            if getattr(config, "response_mime_type", None) == "application/json":
+                # Shape matches the scoring schema: accept every statement.
+                return json.dumps({"score_status": "GOOD", "follow_up_questions": [], "summary": None})
+            return f"(LLM disabled — showing raw details) {str(contents).strip()}"
+
+        def generate_content(self, model, contents, config=None):
+            return SimpleNamespace(text=self._mock_text(contents, config))
+
+        def generate_content_stream(self, model, contents, config=None):
+            yield SimpleNamespace(text=self._mock_text(contents, config))
+
+    def __init__(self):
+        self.models = self._Models()
+
+@st.cache_resource(show_spinner=False)
+def get_client():
+    """Builds the Gemini client once per process; a mock stands in without a key."""
+    try:
+        if "GEMINI_API_KEY" in st.secrets:
+            from google import genai
+            from google.genai import types
+
+            # One long-lived client per process (st.cache_resource) means the
+            # underlying httpx transport keeps its connection pool across
+            # calls, paying the TLS handshake once instead of per request.
+            return genai.Client(
+                api_key=st.secrets["GEMINI_API_KEY"],
+                http_options=types.HttpOptions(timeout=30_000),
+            )
+    except Exception as e:
+        st.error(f"Error initializing Gemini client: {e}")
+    return _MockClient()
 
 DATABASE_FILE = "issue_database.json"
 
+# Keep per-rerun rendering work bounded regardless of how long a chat runs:
+# the history is capped, and only the most recent window is rendered.
+CHAT_HISTORY_MAXLEN = 50
+CHAT_RENDER_WINDOW = 20
+
+# Labels and widget keys of the case-form fields that must be filled before
+# submission; pairing them here means the submit handler does one pass over a
+# static tuple instead of zipping parallel sequences per click.
+REQUIRED_CASE_FIELDS = (
+    ("Full Name", "case_name"),
+    ("Email Address", "case_email"),
+    ("Product Model / Device Name", "case_model"),
+)
+MISSING_FIELDS_PREFIX = "**⚠️ Please fill in all required fields to submit the case.** Missing: "
+
 @st.cache_data
 def load_issue_database(file_path: str) -> list[dict]:
     """
@@ -42,80 +103,302 @@ def load_issue_database(file_path: str) -> list[dict]:
 ISSUE_DATABASE = load_issue_database(DATABASE_FILE)
 
 # Create a master list of all possible causes for the multiselect options list
-if ISSUE_DATABASE:
-    COMMON_CAUSES = [entry["cause"] for entry in ISSUE_DATABASE]
-else:
-    COMMON_CAUSES = []
+@st.cache_data(show_spinner=False)
+def _derive_common_causes(db_len: int) -> tuple:
+    """Derives the cause tuples once per database load (keyed by its size)."""
+    causes = tuple(entry["cause"] for entry in ISSUE_DATABASE)
+    return causes, tuple(sorted(set(causes)))
+
+COMMON_CAUSES, COMMON_CAUSES_SORTED = _derive_common_causes(len(ISSUE_DATABASE))
+
+
+# --- KEYWORD MATCHER ---
+# All database keywords plus the critical power phrases are combined into a
+# single compiled regex alternation, so one C-level scan of the statement
+# replaces an independent Python substring search per keyword.
+
+CRITICAL_POWER_KEYWORDS = frozenset(["no power", "won't turn on", "dead", "power issue"])
+
+# Keyword hits at or above this count pin down a diagnosis confidently enough
+# to skip the LLM scoring round-trip on the initial statement.
+STRONG_MATCH_THRESHOLD = 2
+
+_WORD_RE = re.compile(r"\w+")
+
+# The keyword table is plain ASCII, so statements are lowered with a byte
+# translation table instead of full Unicode case folding. UTF-8 continuation
+# bytes are >= 0x80 and pass through the table untouched.
+_ASCII_LOWER = bytes.maketrans(bytes(range(65, 91)), bytes(range(97, 123)))
+
+def _lower_ascii(text: str) -> str:
+    """ASCII-only lowercasing, cheaper than str.lower for matching purposes."""
+    return text.encode("utf-8").translate(_ASCII_LOWER).decode("utf-8")
+
+@st.cache_resource(show_spinner=False)
+def _build_keyword_matcher():
+    """Compiles the keyword tables once per process.
+
+    Streamlit re-executes this module on every rerun, so the build lives
+    behind st.cache_resource rather than at bare module scope.
+    """
+    # Struct-of-arrays layout: the scoring loop indexes straight into these
+    # parallel tuples instead of dereferencing a dict per database entry.
+    causes = tuple(sys.intern(entry["cause"]) for entry in ISSUE_DATABASE)
+    actions = tuple(entry["action"] for entry in ISSUE_DATABASE)
+
+    # Keywords are explicitly lowercased (the statement is lowered before
+    # matching, so a mixed-case database keyword would silently never match)
+    # and interned so repeated hash/compare operations take the pointer path.
+    keyword_to_entries: dict[str, list[int]] = {}
+    for idx, entry in enumerate(ISSUE_DATABASE):
+        for kw in entry["keywords"]:
+            keyword_to_entries.setdefault(sys.intern(kw.lower()), []).append(idx)
+    for kw in CRITICAL_POWER_KEYWORDS:
+        keyword_to_entries.setdefault(kw, [])
+
+    # Single-token keywords are matched via an O(1) set probe per input token;
+    # only multi-word phrases need the substring scan.
+    single_word_kws = frozenset(kw for kw in keyword_to_entries if _WORD_RE.fullmatch(kw))
+
+    # Longest-first ordering so longer phrases win over their sub-phrases.
+    multi_word_kws = sorted((kw for kw in keyword_to_entries if kw not in single_word_kws), key=len, reverse=True)
+    pattern = re.compile("|".join(re.escape(kw) for kw in multi_word_kws)) if multi_word_kws else None
+
+    # Direct index of the entry the critical-power short-circuit returns, so
+    # the hot path doesn't re-scan the database to find it.
+    try:
+        power_idx = causes.index("Power Supply Unit (PSU) or Power Cable Issue")
+    except ValueError:
+        power_idx = None
+
+    # O(1) cause -> action lookups for the summary builders.
+    cause_to_action = dict(zip(causes, actions))
+
+    return causes, actions, keyword_to_entries, single_word_kws, pattern, power_idx, cause_to_action
+
+_CAUSES, _ACTIONS, _KEYWORD_TO_ENTRIES, _SINGLE_WORD_KWS, _KEYWORD_PATTERN, _POWER_IDX, _CAUSE_TO_ACTION = _build_keyword_matcher()
 
 
 # Pydantic Schema for LLM Response (Scoring)
-class ScoringResponse(BaseModel):
-    """Schema for the model's response on statement scoring."""
-    score_status: str  # 'GOOD' or 'LOW'
-    follow_up_questions: list[str] # List of 2 to 3 questions if score is LOW
+@st.cache_resource(show_spinner=False)
+def get_scoring_schema():
+    """Builds the scoring response schema once, deferring the pydantic import."""
+    from pydantic import BaseModel
+
+    class ScoringResponse(BaseModel):
+        """Schema for the model's response on statement scoring."""
+        score_status: str  # 'GOOD' or 'LOW'
+        follow_up_questions: list[str] # List of 2 to 3 questions if score is LOW
+        summary: str | None = None # Clean rewrite of the statement when score is GOOD
+
+    return ScoringResponse
+
+# --- LLM RESPONSE CACHE ---
+
+LLM_CACHE_FILE = "llm_cache.db"
+
+# In-memory TTL front for the persistent cache: repeat lookups within a
+# process skip the SQLite read, and entries age out so a long-lived server
+# doesn't pin every response it has ever seen.
+LLM_MEMORY_CACHE_TTL = 600  # seconds
+LLM_MEMORY_CACHE_MAX = 512
+
+@st.cache_resource(show_spinner=False)
+def _llm_memory_cache() -> dict:
+    """Process-wide {key: (expires_at, response_text)} front cache."""
+    return {}
+
+def _llm_cache_key(model: str, system_prompt: str, contents: str) -> str:
+    """Builds a stable cache key for one LLM request."""
+    return hashlib.sha256(f"{model}|{system_prompt}|{contents}".encode()).hexdigest()
+
+def _llm_cache_get(key: str):
+    """Returns the cached response text for a key, or None on miss/error."""
+    memory = _llm_memory_cache()
+    entry = memory.get(key)
+    if entry is not None:
+        expires_at, response_text = entry
+        if expires_at > time.monotonic():
+            return response_text
+        del memory[key]
+    try:
+        with sqlite3.connect(LLM_CACHE_FILE) as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS llm_cache(key TEXT PRIMARY KEY, response TEXT)")
+            row = conn.execute("SELECT response FROM llm_cache WHERE key = ?", (key,)).fetchone()
+    except Exception:
+        # The cache is purely an optimization; never let it break the app.
+        return None
+    if row is None:
+        return None
+    _llm_memory_cache_put(key, row[0])
+    return row[0]
+
+def _llm_memory_cache_put(key: str, response_text: str):
+    memory = _llm_memory_cache()
+    if len(memory) >= LLM_MEMORY_CACHE_MAX:
+        # Drop expired entries first; fall back to the oldest insertion.
+        now = time.monotonic()
+        for stale in [k for k, (exp, _) in memory.items() if exp <= now]:
+            del memory[stale]
+        while len(memory) >= LLM_MEMORY_CACHE_MAX:
+            del memory[next(iter(memory))]
+    memory[key] = (time.monotonic() + LLM_MEMORY_CACHE_TTL, response_text)
+
+def _llm_cache_set(key: str, response_text: str):
+    """Stores a response text under a key, ignoring any storage errors."""
+    _llm_memory_cache_put(key, response_text)
+    try:
+        with sqlite3.connect(LLM_CACHE_FILE) as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS llm_cache(key TEXT PRIMARY KEY, response TEXT)")
+            conn.execute("INSERT OR REPLACE INTO llm_cache(key, response) VALUES (?, ?)", (key, response_text))
+    except Exception:
+        pass
+
+# --- SEMANTIC CACHE (scoring) ---
+# Users describe the same issue with different wording ("printer has no power"
+# vs "printer won't power on"), which an exact-key cache misses. Statements are
+# reduced to token sets and compared by Jaccard similarity; a close-enough
+# previously-scored statement reuses its cached response. The threshold is
+# deliberately high to keep the bad-hit rate low.
+
+SEMANTIC_SIMILARITY_THRESHOLD = 0.9
+
+@st.cache_resource(show_spinner=False)
+def _semantic_index() -> list:
+    """Process-wide list of (token_set, response_text) for scored statements."""
+    return []
+
+def _statement_tokens(statement: str) -> frozenset:
+    return frozenset(_WORD_RE.findall(_lower_ascii(statement)))
+
+def _semantic_cache_get(statement: str):
+    """Returns the cached response of the most similar prior statement, or None."""
+    tokens = _statement_tokens(statement)
+    if not tokens:
+        return None
+    best_text = None
+    best_similarity = SEMANTIC_SIMILARITY_THRESHOLD
+    for cached_tokens, response_text in _semantic_index():
+        similarity = len(tokens & cached_tokens) / len(tokens | cached_tokens)
+        if similarity >= best_similarity:
+            best_similarity = similarity
+            best_text = response_text
+    return best_text
+
+def _semantic_cache_add(statement: str, response_text: str):
+    tokens = _statement_tokens(statement)
+    if tokens:
+        _semantic_index().append((tokens, response_text))
 
 # --- 2. LLM FUNCTIONS ---
 
 def get_scoring_and_suggestions(problem_statement: str):
-    """Calls Gemini to score the problem statement and suggest follow-up questions."""
-    
-    if not client:
-        # Mock LLM behavior if client is not available
-        st.session_state.chat_history.append({"role": "assistant", "content": "*(LLM Mock: Running in low-detail mode. Assuming statement is **'GOOD'**.)*"})
-        return "GOOD", []
+    """Calls Gemini to score the statement; returns (score, follow-up questions, summary).
+
+    The summary is a clean one-paragraph rewrite produced in the same call when
+    the score is GOOD (saving a second round-trip), or None otherwise.
+    """
 
+    client = get_client()
+
+    # Kept short and fully static (user content goes in `contents`) so fewer
+    # input tokens are sent and Gemini's server-side prefix cache can hit.
     system_prompt = (
-        "You are an AI technical support triage system. Your task is to evaluate a user's initial problem statement for a hardware issue. "
-        "The problem statement must be complete, specific, and include relevant details like device, error messages, and WHEN the issue started. "
-        "Based on this evaluation, you must return a JSON object."
-        "\n\nJSON Schema:\n"
-        "1. **score_status**: Return 'GOOD' if the statement is detailed, specific, and clear. Return 'LOW' if it is vague, too general, or lacks critical detail (e.g., 'My PC is broken')."
-        "2. **follow_up_questions**: If the score_status is 'LOW', provide 2-3 specific questions to help the user elaborate (e.g., 'What is the exact error code?', 'Did you recently install new software?'). If the score_status is 'GOOD', this list should be empty."
+        "You are a technical support triage system. Evaluate the user's hardware problem statement and return JSON:\n"
+        "- score_status: 'GOOD' if detailed and specific (device, error, when it started); 'LOW' if vague.\n"
+        "- follow_up_questions: 2-3 specific clarifying questions if LOW, else an empty list.\n"
+        "- summary: if GOOD, one clean human-readable paragraph restating the problem; else null."
     )
 
     try:
-        response = client.models.generate_content(
+        # Serve repeat statements from the persistent cache — the Gemini round-trip
+        # dominates this app's latency, so a hit skips 1-10s of waiting.
+        cache_key = _llm_cache_key('gemini-2.5-flash', system_prompt, problem_statement)
+        cached_text = _llm_cache_get(cache_key)
+        if cached_text is None:
+            # Exact miss: a sufficiently similar rephrasing may still hit.
+            cached_text = _semantic_cache_get(problem_statement)
+        if cached_text is not None:
+            data = json.loads(cached_text)
+            return data["score_status"], data.get("follow_up_questions", []), data.get("summary")
+
+        from google.genai import types
+
+        # Stream and accumulate: the structured JSON is only usable complete,
+        # but streaming starts consuming the response at first token.
+        stream = client.models.generate_content_stream(
             model='gemini-2.5-flash',
             contents=f"User's problem statement: '{problem_statement}'",
             config=types.GenerateContentConfig(
                 system_instruction=system_prompt,
                 response_mime_type="application/json",
-                response_schema=ScoringResponse,
+                response_schema=get_scoring_schema(),
+                # Bound the response and keep it deterministic: fewer output
+                # tokens to wait on, and stable answers for the response cache.
+                max_output_tokens=256,
+                temperature=0.0,
             ),
         )
-        
-        # Validate and parse the structured JSON response
-        data = ScoringResponse.model_validate_json(response.text)
-        return data.score_status, data.follow_up_questions
+        response_text = "".join(chunk.text or "" for chunk in stream)
+
+        # Parse the structured JSON response directly — the schema is already
+        # enforced server-side via response_schema, so a plain parse suffices.
+        data = json.loads(response_text)
+        # Mock answers must not poison the persistent cache for later
+        # keyed runs, so only real responses are stored.
+        if not getattr(client, "is_mock", False):
+            _llm_cache_set(cache_key, response_text)
+            _semantic_cache_add(problem_statement, response_text)
+        return data["score_status"], data.get("follow_up_questions", []), data.get("summary")
 
     except Exception as e:
-        # Fallback for API/Pydantic errors
-        st.session_state.chat_history.append({"role": "assistant", "content": f"*(LLM Error: Failed to process request. Assuming score is **'GOOD'** to proceed.)*"})
+        # Fallback for API/parsing errors
+        st.session_state.app.chat_history.append({"role": "assistant", "content": f"*(LLM Error: Failed to process request. Assuming score is **'GOOD'** to proceed.)*"})
         st.exception(e) # Show the error to the coder/user
-        return "GOOD", []
+        return "GOOD", [], None
 
 def generate_human_summary(structured_statement: str) -> str:
     """Uses the LLM to convert the structured statement into a clean, human-readable summary."""
-    if not client:
-        # Fallback if LLM is disabled
-        return f"SUMMARY: {structured_statement.replace('Initial Problem:', 'Problem:').replace('Additional Details:', ' - Details: ')}"
+    client = get_client()
 
     system_prompt = (
-        "You are an expert technical writer. Your task is to take a structured problem description "
-        "(Initial Problem and Additional Details) and synthesize it into a single, clear, coherent, "
-        "and human-readable problem statement (a few sentences maximum). Do not add a greeting or closing. "
-        "Only output the final summary paragraph."
+        "Rewrite the structured problem description (Initial Problem and Additional Details) "
+        "as one clear, human-readable problem statement, a few sentences maximum. "
+        "Output only the summary paragraph."
     )
     
     try:
-        response = client.models.generate_content(
+        # Same persistent cache as the scoring call: identical structured
+        # statements (e.g. from reruns) get their summary without a round-trip.
+        cache_key = _llm_cache_key('gemini-2.5-flash', system_prompt, structured_statement)
+        cached_text = _llm_cache_get(cache_key)
+        if cached_text is not None:
+            return cached_text.strip()
+
+        from google.genai import types
+
+        # Stream the summary into a transient placeholder so the user sees
+        # text at first token instead of a spinner for the full generation.
+        placeholder = st.empty()
+        parts = []
+        for chunk in client.models.generate_content_stream(
             model='gemini-2.5-flash',
             contents=structured_statement,
             config=types.GenerateContentConfig(
                 system_instruction=system_prompt,
+                max_output_tokens=256,
+                temperature=0.0,
             ),
-        )
-        return response.text.strip()
+        ):
+            if chunk.text:
+                parts.append(chunk.text)
+                placeholder.markdown("".join(parts))
+        placeholder.empty()
+
+        summary_text = "".join(parts)
+        if not getattr(client, "is_mock", False):
+            _llm_cache_set(cache_key, summary_text)
+        return summary_text.strip()
         
     except Exception as e:
         # Fallback if LLM fails here
@@ -124,128 +407,213 @@ def generate_human_summary(structured_statement: str) -> str:
 
 # app.py (New LLM Function: refine_problem_statement_with_causes)
 
+# Prompt and input construction live at module level so the speculative
+# prefetch below builds byte-identical cache keys to the real call.
+_REFINE_SYSTEM_PROMPT = (
+    "You are an expert technical writer for a hardware support team. Your task is to review the "
+    "Original Problem Statement and the User-Confirmed Root Causes, and synthesize them into a "
+    "single, highly specific, and actionable **Case Summary** for a human agent. "
+    "The summary must be concise (2-3 sentences max) and clearly link the user's symptoms to the confirmed causes. "
+    "Start the output with 'Final Case Summary: ' and nothing else."
+)
+
+def _refine_input_text(original_statement: str, causes_text: str) -> str:
+    return f"""
+    Original Problem Statement: {original_statement}
+    User-Confirmed Root Causes: {causes_text}
+    """
+
+def _prefetch_case_summary(client, original_statement: str, selected_causes: tuple):
+    """Warms the response cache for the case summary; runs on a worker thread.
+
+    Best-effort only: errors are swallowed and nothing is rendered — the
+    foreground call simply finds (or misses) the cache entry later.
+    """
+    if getattr(client, "is_mock", False):
+        return
+    input_text = _refine_input_text(original_statement, ', '.join(selected_causes))
+    cache_key = _llm_cache_key('gemini-2.5-flash', _REFINE_SYSTEM_PROMPT, input_text)
+    if _llm_cache_get(cache_key) is not None:
+        return
+    try:
+        from google.genai import types
+
+        response = client.models.generate_content(
+            model='gemini-2.5-flash',
+            contents=input_text,
+            config=types.GenerateContentConfig(
+                system_instruction=_REFINE_SYSTEM_PROMPT,
+            ),
+        )
+        _llm_cache_set(cache_key, response.text.strip())
+    except Exception:
+        pass
+
 def refine_problem_statement_with_causes(original_statement: str, selected_causes: list) -> str:
     """Uses the LLM to synthesize the problem statement and the user's selected causes."""
-    global client
-    if not client:
-        # Fallback if LLM is disabled
-        return f"FINAL CASE SUMMARY (LLM Disabled): {original_statement} - User confirmed the following likely causes: {', '.join(selected_causes)}"
+    client = get_client()
+
+    # Joined once up front; reused in the prompt and the error fallback.
+    causes_text = ', '.join(selected_causes)
 
     # Construct the instruction for the LLM
-    input_text = f"""
-    Original Problem Statement: {original_statement}
-    User-Confirmed Root Causes: {', '.join(selected_causes)}
-    """
+    input_text = _refine_input_text(original_statement, causes_text)
+
+    system_prompt = _REFINE_SYSTEM_PROMPT
+
+    cache_key = _llm_cache_key('gemini-2.5-flash', system_prompt, input_text)
+    cached = _llm_cache_get(cache_key)
+    if cached is not None:
+        return cached.strip()
 
-    system_prompt = (
-        "You are an expert technical writer for a hardware support team. Your task is to review the "
-        "Original Problem Statement and the User-Confirmed Root Causes, and synthesize them into a "
-        "single, highly specific, and actionable **Case Summary** for a human agent. "
-        "The summary must be concise (2-3 sentences max) and clearly link the user's symptoms to the confirmed causes. "
-        "Start the output with 'Final Case Summary: ' and nothing else."
-    )
-    
     try:
-        response = client.models.generate_content(
+        from google.genai import types
+
+        # Stream into a transient placeholder, matching the summary path:
+        # first tokens appear immediately instead of after full generation.
+        placeholder = st.empty()
+        parts = []
+        for chunk in client.models.generate_content_stream(
             model='gemini-2.5-flash',
             contents=input_text,
             config=types.GenerateContentConfig(
                 system_instruction=system_prompt,
             ),
-        )
-        return response.text.strip()
-        
+        ):
+            if chunk.text:
+                parts.append(chunk.text)
+                placeholder.markdown("".join(parts))
+        placeholder.empty()
+
+        response_text = "".join(parts).strip()
+        if not getattr(client, "is_mock", False):
+            _llm_cache_set(cache_key, response_text)
+        return response_text
+
     except Exception as e:
         st.error(f"Error generating final case summary: {e}")
-        return f"Final Case Summary: {original_statement} - Confirmed Causes: {', '.join(selected_causes)}"
+        return f"Final Case Summary: {original_statement} - Confirmed Causes: {causes_text}"
 
 # --- UTILITY FUNCTIONS ---
 
 def run_with_progress(task_description, func, *args, **kwargs):
-    """Shows a spinner and processing message while running a function."""
+    """Shows a transient status indicator while running a function."""
     with st.chat_message("assistant"):
-        # Add a message to the chat history to reflect the processing
-        st.session_state.chat_history.append({"role": "assistant", "content": f"*(Processing: {task_description})*"})
-
-        with st.spinner(f"**Thinking...** {task_description}"):
-            # Run the actual function
+        # st.status renders its own transient widget, so no temporary message
+        # has to be appended to (and popped from) the authoritative history.
+        # Expanded while running so anything the wrapped function streams
+        # (e.g. the Step 3 summary placeholder) is actually visible, then
+        # collapsed once the work is done.
+        with st.status(f"**Thinking...** {task_description}", expanded=True) as status:
             result = func(*args, **kwargs)
-            
-            # Remove the processing message from the history before showing the final result
-            st.session_state.chat_history.pop() 
-            
+            status.update(state="complete", expanded=False)
             return result
 
+_GREETING = "Hello! I'm your Technical Support Bot. Please describe the hardware issue you are facing to begin the triage process."
+
+def _new_chat_history() -> deque:
+    return deque([{"role": "assistant", "content": _GREETING}], maxlen=CHAT_HISTORY_MAXLEN)
+
+@dataclass(slots=True)
+class ChatState:
+    """Per-session triage state, held under a single st.session_state key.
+
+    One attribute access replaces a session-state dict probe per field, and
+    slots keep the instance compact. Step meaning: 1 initial input, 2
+    refinement, 3 diagnosis confirmation, 3.5 resolution check, 4 case
+    form, 5 finished.
+    """
+    chat_history: deque = field(default_factory=_new_chat_history)
+    step: float = 1
+    problem_statement: str = ""
+    refinement_history: list = field(default_factory=list)
+    pending_questions: list = field(default_factory=list)
+    suggested_action: str = ""
+    suggested_cause: str = ""
+    selected_causes: list = field(default_factory=list)
+    problem_statement_confirmed: bool = False
+    resolved: bool = False
+
 def update_chat(role, content):
     """Helper function to add messages to the chat history."""
-    st.session_state.chat_history.append({"role": role, "content": content})
+    st.session_state.app.chat_history.append({"role": role, "content": content})
+
+def append_turn(user_msg: str, bot_msg: str):
+    """Appends a user/assistant exchange in one extend instead of two appends."""
+    st.session_state.app.chat_history.extend((
+        {"role": "user", "content": user_msg},
+        {"role": "assistant", "content": bot_msg},
+    ))
 
 def reset_chat():
     """Resets the entire chat state."""
-    st.session_state.chat_history = [{"role": "assistant", "content": "Hello! I'm your Technical Support Bot. Please describe the hardware issue you are facing to begin the triage process."}]
-    st.session_state.step = 1
-    st.session_state.problem_statement = ""
-    st.session_state.refinement_history = []
-    st.session_state.pending_questions = []
-    st.session_state.suggested_action = ""
-    st.session_state.suggested_cause = ""
-    st.session_state.selected_causes = []
-    st.session_state.problem_statement_confirmed = False
+    st.session_state.app = ChatState()
     # st.rerun() <--- Rerun is not needed here because the button's callback handles it.
 
-def log_new_issue_for_review(form_data: dict):
-    """Appends an uncategorized issue to a JSONL file for human review."""
+def log_new_issue_for_review(form_data: "CaseForm"):
+    """Appends an uncategorized issue to a JSONL file for human review.
+
+    Runs on a background thread, so failures are reported to the server log
+    rather than through Streamlit elements.
+    """
     log_file = "new_issues_log.jsonl"
     try:
         with open(log_file, 'a', newline='', encoding='utf-8') as f:
             # Create a log entry dictionary
             log_entry = {
-                "problem_statement": form_data['problem_statement'],
-                "final_selected_causes": form_data['selected_causes']
+                "problem_statement": form_data.problem_statement,
+                "final_selected_causes": form_data.selected_causes
             }
             # Write the JSON object as a single line
             f.write(json.dumps(log_entry) + '\n')
     except Exception as e:
-        st.warning(f"Could not write to the new issue log file '{log_file}': {e}")
+        print(f"Could not write to the new issue log file '{log_file}': {e}", file=sys.stderr)
+
+@st.cache_data(show_spinner=False, max_entries=256)
+def _match_with_score(problem_statement: str):
+    """Prioritized keyword matching; returns (action, cause, keyword hit count)."""
+
+    statement_lower = _lower_ascii(problem_statement)
+
+    # Single pass over the statement: collect every keyword hit (deduplicated,
+    # matching the old one-point-per-keyword scoring) and flag the critical
+    # power phrases in the same scan.
+    matched_keywords = set()
+    for token in _WORD_RE.findall(statement_lower):
+        if token in _SINGLE_WORD_KWS:
+            matched_keywords.add(token)
+    if _KEYWORD_PATTERN:
+        for match in _KEYWORD_PATTERN.finditer(statement_lower):
+            matched_keywords.add(match.group(0))
 
-def find_best_match_action_by_statement(problem_statement: str):
-    """Performs prioritized keyword matching against the mock database using the full problem statement."""
-    
-    statement_lower = problem_statement.lower()
-    
     # --- 1. CRITICAL PRIORITY CHECK (NO POWER) ---
-    critical_power_keywords = ["no power", "won't turn on", "dead", "power issue"]
-    
-    is_power_issue = any(kw in statement_lower for kw in critical_power_keywords)
-    
-    if is_power_issue:
-        # Search the database specifically for the Power Supply entry
-        for db_entry in ISSUE_DATABASE:
-             if db_entry["cause"] == "Power Supply Unit (PSU) or Power Cable Issue":
-                 return db_entry["action"], db_entry["cause"]
+    power_hits = matched_keywords & CRITICAL_POWER_KEYWORDS
+    if _POWER_IDX is not None and power_hits:
+        # The short-circuit is authoritative regardless of count, so report
+        # at least a strong score for the pre-filter in handle_initial_input.
+        return _ACTIONS[_POWER_IDX], _CAUSES[_POWER_IDX], max(len(power_hits), STRONG_MATCH_THRESHOLD)
 
     # --- 2. FALLBACK SCORE CHECK (for all other issues) ---
-    best_match = None
-    best_score = 0
-    
-    for db_entry in ISSUE_DATABASE:
-        score = 0
-        for keyword in db_entry["keywords"]:
-            if keyword in statement_lower:
-                score += 1
-        
-        if score > best_score:
-            best_score = score
-            best_match = db_entry
-
-    if best_match:
-        return best_match["action"], best_match["cause"]
+    scores = [0] * len(_CAUSES)
+    for keyword in matched_keywords:
+        for idx in _KEYWORD_TO_ENTRIES[keyword]:
+            scores[idx] += 1
+
+    best_score = max(scores, default=0)
+    if best_score > 0:
+        best_idx = scores.index(best_score)
+        return _ACTIONS[best_idx], _CAUSES[best_idx], best_score
     else:
         # If no keyword match is found, explicitly find and return the fallback "Uncategorized" entry.
         # This is more robust than assuming it's the last item in the list.
-        for entry in ISSUE_DATABASE:
-            if entry["cause"] == "Uncategorized/Complex Issue":
-                return entry["action"], entry["cause"]
+        for idx, cause in enumerate(_CAUSES):
+            if cause == "Uncategorized/Complex Issue":
+                return _ACTIONS[idx], cause, 0
+
+def find_best_match_action_by_statement(problem_statement: str):
+    """Performs prioritized keyword matching against the mock database using the full problem statement."""
+    action, cause, _ = _match_with_score(problem_statement)
+    return action, cause
 
 # --- HANDLER FUNCTIONS ---
 
@@ -254,101 +622,108 @@ def handle_initial_input(user_input):
     update_chat("user", user_input) 
 
     # 1. Store the initial problem statement
-    st.session_state.problem_statement = user_input
-    
-    # Use progress indicator for the LLM call
-    score, questions = run_with_progress("Analyzing your statement and generating follow-up questions...", get_scoring_and_suggestions, user_input)
-    
+    st.session_state.app.problem_statement = user_input
+
+    # Cheap pre-filter: a strong keyword hit in the rule base already pins
+    # down the diagnosis, so the LLM scoring round-trip can be skipped.
+    action, cause, match_score = _match_with_score(user_input)
+    if cause != "Uncategorized/Complex Issue" and match_score >= STRONG_MATCH_THRESHOLD:
+        score, questions = "GOOD", []
+    else:
+        # Use progress indicator for the LLM call
+        score, questions, _ = run_with_progress("Analyzing your statement and generating follow-up questions...", get_scoring_and_suggestions, user_input)
+
     if score == "LOW":
-        st.session_state.pending_questions = questions # Store all questions
+        st.session_state.app.pending_questions = questions # Store all questions
         
         # Ask the FIRST question conversationally
-        first_q = st.session_state.pending_questions.pop(0) 
+        first_q = st.session_state.app.pending_questions.pop(0) 
         update_chat("assistant", f"Thank you for the initial statement. To provide better support, I need a little more detail. Okay, let's start with a quick question to narrow things down:\n\n**{first_q}**\n\n*(Please provide your answer.)*")
         
-        st.session_state.step = 2 # Move to refinement mode
+        st.session_state.app.step = 2 # Move to refinement mode
     
     else:
         # --- LOGIC FOR CLEAR STATEMENT (HIGH SCORE) ---
-        
-        # 1. Run Automatic Diagnosis
-        action, cause = find_best_match_action_by_statement(user_input)
-        
+        # The automatic diagnosis was already computed by the pre-filter above.
+
         if cause == "Uncategorized/Complex Issue":
             # If the issue is complex, skip diagnosis confirmation and go directly to case creation.
-            st.session_state.suggested_cause = cause
-            st.session_state.selected_causes = [cause]
+            st.session_state.app.suggested_cause = cause
+            st.session_state.app.selected_causes = [cause]
             update_chat("assistant", 
                 "Thank you for the clear statement. This seems to be a complex issue that I can't categorize automatically. "
                 "Let's create a support case directly for a human agent to review. Please fill out the form below."
             )
-            st.session_state.step = 4 # Go directly to Case Creation
+            st.session_state.app.step = 4 # Go directly to Case Creation
         else:
             # For standard issues, proceed to the normal diagnosis confirmation step.
-            st.session_state.suggested_action = action
-            st.session_state.suggested_cause = cause
-            st.session_state.selected_causes = [cause]
+            st.session_state.app.suggested_action = action
+            st.session_state.app.suggested_cause = cause
+            st.session_state.app.selected_causes = [cause]
             
             update_chat("assistant", 
                 f"Your initial problem statement is very clear! Based on this, I have identified the most probable cause as **{cause}**. "
                 "Please review and confirm the diagnosis below before we proceed to the suggested action."
             )
             # Go to the Diagnosis Confirmation (Step 3)
-            st.session_state.step = 3
-        
-    st.rerun()
+            st.session_state.app.step = 3
+
+    st.rerun(scope="app")
 
 def handle_refinement(user_input):
     """Handles Step 2: User refines the statement and determines if more questions are needed."""
     update_chat("user", user_input)
     
     # 1. Store the new answer
-    st.session_state.refinement_history.append(user_input)
+    st.session_state.app.refinement_history.append(user_input)
     
     # 2. Build the FULL statement (initial + all refinements)
     full_statement_for_llm = (
-        f"Initial Problem: {st.session_state.problem_statement}\n"
-        f"Additional Details: {', '.join(st.session_state.refinement_history)}"
+        f"Initial Problem: {st.session_state.app.problem_statement}\n"
+        f"Additional Details: {', '.join(st.session_state.app.refinement_history)}"
     )
     
     # 3. Check if we have PENDING questions
-    if st.session_state.pending_questions:
+    if st.session_state.app.pending_questions:
         
         # Ask the NEXT question conversationally
-        next_q = st.session_state.pending_questions.pop(0)
-        q_num = len(st.session_state.refinement_history)
+        next_q = st.session_state.app.pending_questions.pop(0)
+        q_num = len(st.session_state.app.refinement_history)
         
         transition = "Thanks for the information. And next, can you tell me:" if q_num == 1 else "I'm still trying to narrow this down. What about this:"
         
         update_chat("assistant", f"{transition}\n\n**{next_q}**\n\n*(Please provide your answer.)*")
-        st.rerun() # Stay in Step 2, waiting for next input
+        # Stay in Step 2, waiting for next input. Plain rerun: scope="fragment"
+        # raises when the handler happens to run during a full-script pass.
+        st.rerun()
 
     else:
         # 4. If all initial questions are answered, check the score of the FULL statement
-        st.session_state.problem_statement = full_statement_for_llm # Save the structured statement for later steps
+        st.session_state.app.problem_statement = full_statement_for_llm # Save the structured statement for later steps
         
-        score, new_questions = run_with_progress("Re-analyzing the full context with your new details...", get_scoring_and_suggestions, full_statement_for_llm)
+        score, new_questions, summary = run_with_progress("Re-analyzing the full context with your new details...", get_scoring_and_suggestions, full_statement_for_llm)
 
         if score == "LOW" and new_questions:
             # Score is still low: ask the new batch of questions one-by-one
-            st.session_state.pending_questions = new_questions
-            next_q = st.session_state.pending_questions.pop(0)
+            st.session_state.app.pending_questions = new_questions
+            next_q = st.session_state.app.pending_questions.pop(0)
             update_chat("assistant", f"I appreciate the extra detail, but the overall picture still needs clarification. Let's try this critical question:\n\n**{next_q}**\n\n*(Please provide your answer.)*")
             
         else:
             # Score is GOOD or LLM couldn't provide more questions
-            
-            # Generate a final, human-readable summary for display in the chat
-            final_summary = generate_human_summary(st.session_state.problem_statement)
+
+            # The scoring call already produced the clean summary; only fall
+            # back to a dedicated summary call if it came back empty.
+            final_summary = summary or generate_human_summary(st.session_state.app.problem_statement)
             
             # Store this clean summary for the final case creation step
-            st.session_state.problem_statement = final_summary
-            st.session_state.problem_statement_confirmed = False 
-            st.session_state.step = 2.5 
-            
-            update_chat("assistant", f"Excellent! I've combined all the details. Before we move to the diagnostic phase, could you please confirm I have accurately summarized your issue?\n\n**My Understanding (Summary):**\n\n> {st.session_state.problem_statement}\n\nIs this statement correct? (Please answer 'Yes' or 'No')")
+            st.session_state.app.problem_statement = final_summary
+            st.session_state.app.problem_statement_confirmed = False 
+            st.session_state.app.step = 2.5 
             
-        st.rerun()
+            update_chat("assistant", f"Excellent! I've combined all the details. Before we move to the diagnostic phase, could you please confirm I have accurately summarized your issue?\n\n**My Understanding (Summary):**\n\n> {st.session_state.app.problem_statement}\n\nIs this statement correct? (Please answer 'Yes' or 'No')")
+
+        st.rerun(scope="app")
 
 def handle_confirmation(user_input):
     """Handles Step 2.5: User confirms the problem statement summary."""
@@ -356,68 +731,69 @@ def handle_confirmation(user_input):
     update_chat("user", user_input)
     
     if user_response in ["yes", "yep", "correct", "yes it is", "yes, correct"]:
-        st.session_state.problem_statement_confirmed = True
-        
-        # Automatically diagnose using the confirmed problem statement
-        action, cause = find_best_match_action_by_statement(st.session_state.problem_statement)
+        st.session_state.app.problem_statement_confirmed = True
+
+        # Reuse an earlier diagnosis of this session if one was already made;
+        # otherwise diagnose the confirmed problem statement now.
+        if st.session_state.app.suggested_action and st.session_state.app.suggested_cause:
+            action, cause = st.session_state.app.suggested_action, st.session_state.app.suggested_cause
+        else:
+            action, cause = find_best_match_action_by_statement(st.session_state.app.problem_statement)
         
         if cause == "Uncategorized/Complex Issue":
             # If the issue is complex, skip diagnosis confirmation and go directly to case creation.
-            st.session_state.suggested_cause = cause
-            st.session_state.selected_causes = [cause]
+            st.session_state.app.suggested_cause = cause
+            st.session_state.app.selected_causes = [cause]
             update_chat("assistant", 
                 "Thank you for confirming the summary. This seems to be a complex issue that I can't categorize automatically. "
                 "Let's create a support case directly for a human agent to review. Please fill out the form below."
             )
-            st.session_state.step = 4 # Go directly to Case Creation
+            st.session_state.app.step = 4 # Go directly to Case Creation
         else:
             # For standard issues, proceed to the normal diagnosis confirmation step.
-            st.session_state.suggested_action = action
-            st.session_state.suggested_cause = cause
-            st.session_state.selected_causes = [cause]
+            st.session_state.app.suggested_action = action
+            st.session_state.app.suggested_cause = cause
+            st.session_state.app.selected_causes = [cause]
             update_chat("assistant", f"Great, confirmed! Based on your detailed statement, I have identified the most probable cause as **{cause}**. Please review and confirm the diagnosis below before we proceed.")
-            st.session_state.step = 3 # Go to Diagnosis Confirmation
+            st.session_state.app.step = 3 # Go to Diagnosis Confirmation
         
     elif user_response in ["no", "nope", "incorrect", "no it's not", "no, incorrect"]:
-        st.session_state.problem_statement_confirmed = False
+        st.session_state.app.problem_statement_confirmed = False
         
         # Clear refinement and go back to a manual input to fix the summary
-        st.session_state.refinement_history = []
-        st.session_state.pending_questions = []
+        st.session_state.app.refinement_history = []
+        st.session_state.app.pending_questions = []
         
         update_chat("assistant", "Apologies for the misunderstanding. Please provide a **new, complete and accurate summary** of your issue, incorporating any details I missed. This will restart the scoring process.")
-        st.session_state.step = 1.5
+        st.session_state.app.step = 1.5
     
     else:
         # Prompt for a clear Yes/No answer
         update_chat("assistant", "Please confirm by simply typing 'Yes' or 'No'.")
-        # Step remains 2.5
-        
-    st.rerun()
+        # Step remains 2.5. Plain rerun: scope="fragment" raises when the
+        # handler happens to run during a full-script pass.
+        st.rerun()
 
-def generate_comprehensive_action_summary(selected_causes: list) -> str:
+    st.rerun(scope="app")
+
+@st.cache_data(show_spinner=False)
+def generate_comprehensive_action_summary(selected_causes: tuple) -> str:
     """
-    Retrieves and combines suggested actions for all confirmed causes by 
-    searching the ISSUE_DATABASE list, ensuring clear separation for rendering.
+    Retrieves and combines suggested actions for all confirmed causes via the
+    precomputed cause->action table, ensuring clear separation for rendering.
+
+    Pure derivation of the (hashable) cause selection, so repeat reruns with
+    the same selection hit Streamlit's memoization layer.
     """
-    # NOTE: Ensure ISSUE_DATABASE is accessible (e.g., globally defined or passed in)
-    
     if not selected_causes:
         return "No specific action suggested as no root cause was selected."
-    
+
     action_parts = []
-    
+
     # Iterate through the causes confirmed by the user
     for confirmed_cause in selected_causes:
-        found_action = "No specific action found in database."
-        
-        # Search the ISSUE_DATABASE for the matching cause
-        for entry in ISSUE_DATABASE:
-            if entry.get("cause") == confirmed_cause:
-                # Found the entry, retrieve the action
-                found_action = entry.get("action", "Action not defined in entry.")
-                break 
-        
+        found_action = _CAUSE_TO_ACTION.get(confirmed_cause, "No specific action found in database.")
+
         # Format the entry with a bullet point and bold text
         # Using the exact formatting provided in your example output
         action_parts.append(f"• **{confirmed_cause} Action:** {found_action}")
@@ -426,59 +802,102 @@ def generate_comprehensive_action_summary(selected_causes: list) -> str:
     # to force distinct paragraph breaks in the final rendered output.
     return "\n\n".join(action_parts)
 
+@dataclass(frozen=True, slots=True)
+class CaseForm:
+    """A validated Step 4 case submission. Frozen: a submission is a fact,
+    and immutability makes it hashable and safe to hand to worker threads."""
+    name: str
+    email: str
+    phone: str
+    product_model: str
+    problem_statement: str
+    selected_causes: tuple
+    suggested_cause: str
+
+def _report_missing_fields(placeholder, missing_fields):
+    """Shows the Step 4 validation error for the given missing-field labels."""
+    st.session_state._val_err = True
+    placeholder.error(MISSING_FIELDS_PREFIX + ", ".join(missing_fields))
+
+def _submit_case_form(placeholder, name, email, phone, product_model, final_statement):
+    """Clears any prior validation error and submits the validated case form."""
+    # Only clear the placeholder if an error was actually shown —
+    # .empty() on a clean placeholder is a wasted frontend round-trip.
+    if st.session_state.get("_val_err"):
+        placeholder.empty()
+        st.session_state._val_err = False
+    # Bind the session-state reads once instead of going through the
+    # SessionState proxy per field.
+    app = st.session_state.app
+    form_data = CaseForm(
+        name=name,
+        email=email,
+        phone=phone,
+        product_model=product_model,
+        problem_statement=final_statement,
+        selected_causes=tuple(app.selected_causes),
+        suggested_cause=app.suggested_cause,
+    )
+    # This will update the chat history and rerender the final step (Step 5)
+    handle_case_submission(form_data)
+
+@st.cache_resource(show_spinner=False)
+def _case_executor():
+    """Shared worker pool for post-submission I/O — one per process, so
+    concurrent sessions reuse the same threads instead of each spawning
+    an executor into their session state."""
+    return ThreadPoolExecutor(max_workers=4)
+
+@st.cache_resource(show_spinner=False)
+def _case_id_counter():
+    """Process-wide monotonic ticket counter, seeded from the start time.
+
+    A counter avoids the getrandom syscall per submission and makes IDs
+    monotonically scannable in logs; collisions across restarts are
+    acceptable for mock ticket numbers.
+    """
+    return itertools.count(int(time.time()))
+
 def handle_case_submission(form_data):
     """Handles Step 4: Final case submission."""
     # In a real application, this data would be sent to a CRM/ticketing system via an API call.
     # For this demonstration, we are just generating a mock case ID.
     
-    # If the issue was uncategorized, log it for future database improvement
-    if "Uncategorized/Complex Issue" in form_data['selected_causes']:
-        log_new_issue_for_review(form_data)
+    # If the issue was uncategorized, log it for future database improvement.
+    # The write is pure file I/O the user never sees, so it runs on a
+    # background worker instead of blocking the submit rerun on disk.
+    if "Uncategorized/Complex Issue" in form_data.selected_causes:
+        _case_executor().submit(log_new_issue_for_review, form_data)
         st.toast("This uncategorized issue has been logged for future improvement. Thank you!")
 
     # Generate a mock Case ID
-    case_id = f"TKT-{os.urandom(4).hex().upper()}"
+    case_id = f"TKT-{next(_case_id_counter()) & 0xFFFFFFFF:08X}"
 
     # Prepare final chat message to confirm submission
     confirmation_message = (
         f"**Case Successfully Created!** 🎉\n\n"
         f"- **Case ID:** {case_id}\n"
-        f"- **Contact:** {form_data['name']} ({form_data['email']})\n"
-        f"- **Issue:** {form_data['problem_statement']}\n"
-        f"- **Bot Diagnosis:** {form_data['suggested_cause']}\n\n"
+        f"- **Contact:** {form_data.name} ({form_data.email})\n"
+        f"- **Issue:** {form_data.problem_statement}\n"
+        f"- **Bot Diagnosis:** {form_data.suggested_cause}\n\n"
         f"Your case has been submitted to a human agent who will review the suggested action and contact you shortly."
     )
     
     # Update chat history with the confirmation
-    st.session_state.chat_history.append({"role": "assistant", "content": confirmation_message})
+    st.session_state.app.chat_history.append({"role": "assistant", "content": confirmation_message})
     
-    # Block further chat and offer reset
-    st.session_state.step = 5
-    st.rerun()
+    # Block further chat and offer reset; the form runs as a fragment, so the
+    # step transition needs an app-scoped rerun to swap in the Step 5 view.
+    st.session_state.app.step = 5
+    st.rerun(scope="app")
 
 # --- 3. STREAMLIT APP LOGIC (Session State Initialization) ---
 
-# Initialize Session State
-if "chat_history" not in st.session_state:
-    st.session_state.chat_history = [{"role": "assistant", "content": "Hello! I'm your Technical Support Bot. Please describe the hardware issue you are facing to begin the triage process."}]
-if "step" not in st.session_state:
-    st.session_state.step = 1 # 1: Initial Input, 2: Scoring, 3: Checklist, 4: Case Form
-if "problem_statement" not in st.session_state:
-    st.session_state.problem_statement = ""
-if "refinement_history" not in st.session_state:
-    st.session_state.refinement_history = [] 
-if "pending_questions" not in st.session_state: 
-    st.session_state.pending_questions = []
-if "follow_up_questions" not in st.session_state:
-    st.session_state.follow_up_questions = []
-if "suggested_action" not in st.session_state:
-    st.session_state.suggested_action = ""
-if "suggested_cause" not in st.session_state:
-    st.session_state.suggested_cause = ""
-if "selected_causes" not in st.session_state:
-    st.session_state.selected_causes = []
-if "problem_statement_confirmed" not in st.session_state:
-    st.session_state.problem_statement_confirmed = False
+# Initialize Session State: all per-session triage state lives in one
+# ChatState under st.session_state.app (one membership check per rerun
+# instead of one per key). Widget keys and transient memo keys stay loose.
+if "app" not in st.session_state:
+    st.session_state.app = ChatState()
 
 
 # --- 4. STREAMLIT UI ---
@@ -491,79 +910,94 @@ with st.sidebar:
     st.header("Chat Controls")
     st.button("Start New Chat", on_click=reset_chat, type="primary")
     st.markdown("---")
-    st.markdown(f"**Current Stage:** **Step {st.session_state.step}**")
-    if st.session_state.problem_statement:
+    st.markdown(f"**Current Stage:** **Step {st.session_state.app.step}**")
+    if st.session_state.app.problem_statement:
         st.markdown("**Refined Problem:**")
-        st.caption(st.session_state.problem_statement)
+        st.caption(st.session_state.app.problem_statement)
     
     # Instruction for API Key
-    if not client:
+    if getattr(get_client(), "is_mock", False):
         st.warning("⚠️ LLM is disabled. Set GEMINI_API_KEY in secrets.toml.")
 
 
-# Chat Display Container
-chat_container = st.container(height=400)
-with chat_container:
-    for message in st.session_state.chat_history:
-        with st.chat_message(message["role"]):
-            st.markdown(message["content"])
+# Chat Display + Input (runs as a fragment: chat turns that stay on the chat
+# steps rerun only this block; handlers moving to a form step request a full
+# app rerun so the sidebar and the step UI below update too).
+@st.fragment
+def render_chat_and_input():
+    chat_container = st.container(height=400)
+    with chat_container:
+        for message in list(st.session_state.app.chat_history)[-CHAT_RENDER_WINDOW:]:
+            with st.chat_message(message["role"]):
+                st.markdown(message["content"])
 
-st.markdown("---")
+    st.markdown("---")
 
-# Input Handling (Based on Step)
+    # Input Handling (Based on Step)
 
-if st.session_state.step in [1, 1.5, 2]:
-    # --- Step 1, 1.5 (Restart), & 2: Initial Input / Refinement ---
-    
-    if st.session_state.step == 1:
-        prompt_placeholder = "Describe your hardware issue (e.g., My printer won't connect after I updated the OS)."
-        handler_func = handle_initial_input
-    
-    elif st.session_state.step == 1.5:
-        prompt_placeholder = "Enter your new, complete problem summary."
-        handler_func = handle_initial_input
-        # Temporarily revert to 1 to match the prompt above, but logic uses 1.5
-        st.session_state.step = 1
-
-    else: # st.session_state.step == 2
-        prompt_placeholder = "Enter your answer to the question."
-        handler_func = handle_refinement
-
-    user_input = st.chat_input(prompt_placeholder, key="user_input")
-    if user_input:
-        handler_func(user_input)
-
-elif st.session_state.step == 2.5:
-    # --- Step 2.5: Confirmation ---
-    prompt_placeholder = "Is the problem statement correct? Type 'Yes' or 'No'."
-    user_input = st.chat_input(prompt_placeholder, key="confirm_input")
-    if user_input:
-        handle_confirmation(user_input)
-
-elif st.session_state.step == 3:
+    if st.session_state.app.step in [1, 1.5, 2]:
+        # --- Step 1, 1.5 (Restart), & 2: Initial Input / Refinement ---
+
+        if st.session_state.app.step == 1:
+            prompt_placeholder = "Describe your hardware issue (e.g., My printer won't connect after I updated the OS)."
+            handler_func = handle_initial_input
+
+        elif st.session_state.app.step == 1.5:
+            prompt_placeholder = "Enter your new, complete problem summary."
+            handler_func = handle_initial_input
+            # Temporarily revert to 1 to match the prompt above, but logic uses 1.5
+            st.session_state.app.step = 1
+
+        else: # st.session_state.app.step == 2
+            prompt_placeholder = "Enter your answer to the question."
+            handler_func = handle_refinement
+
+        user_input = st.chat_input(prompt_placeholder, key="user_input")
+        if user_input:
+            handler_func(user_input)
+
+    elif st.session_state.app.step == 2.5:
+        # --- Step 2.5: Confirmation ---
+        prompt_placeholder = "Is the problem statement correct? Type 'Yes' or 'No'."
+        user_input = st.chat_input(prompt_placeholder, key="confirm_input")
+        if user_input:
+            handle_confirmation(user_input)
+
+render_chat_and_input()
+
+# --- Step views (dispatched through STEP_VIEWS below) ---
+
+def render_diagnosis_confirmation():
     # --- Step 3: Diagnosis Confirmation (User interacts with form) ---
     st.subheader("Step 3: Confirm Diagnosis")
-    st.markdown("Based on the chat, we have identified the most probable cause. Please **review and adjust** the selected causes below.")
 
-    options_list = sorted(list(COMMON_CAUSES)) 
+    # Speculative prefetch: while the user reads and confirms, a worker
+    # thread warms the summary cache for the currently suggested causes, so
+    # the confirm click usually finds its answer already cached. Guarded by
+    # a session key so reruns of this step don't relaunch the thread.
+    prefetch_key = (st.session_state.app.problem_statement, tuple(st.session_state.app.selected_causes))
+    if st.session_state.get("_summary_prefetch_key") != prefetch_key:
+        st.session_state._summary_prefetch_key = prefetch_key
+        threading.Thread(target=_prefetch_case_summary, args=(get_client(), *prefetch_key), daemon=True).start()
+    st.markdown("Based on the chat, we have identified the most probable cause. Please **review and adjust** the selected causes below.")
 
     with st.form("diagnosis_confirmation_form"):
-        
+
         # Multiselect allows user to change the causes, but defaults to the bot's suggestion
         st.multiselect(
             "Select ALL potential Root Causes (Adjust the pre-selected option as needed):",
-            options=options_list,
-            default=st.session_state.selected_causes, 
+            options=COMMON_CAUSES_SORTED,
+            default=st.session_state.app.selected_causes, 
             key="final_cause_selection" 
         )
         
-        st.markdown(f"**Bot's Primary Suggestion:** {st.session_state.suggested_cause}")
+        st.markdown(f"**Bot's Primary Suggestion:** {st.session_state.app.suggested_cause}")
         st.info("The primary cause is used to determine the first suggested action.")
 
         proceed_button = st.form_submit_button(
             "Confirm Diagnosis and View Suggested Action", 
             type="primary",
-            disabled=not st.session_state.selected_causes 
+            disabled=not st.session_state.app.selected_causes 
         )
 
     if proceed_button:
@@ -574,12 +1008,12 @@ elif st.session_state.step == 3:
             st.warning("Please select at least one cause to proceed.")
             st.rerun() 
 
-        st.session_state.selected_causes = final_selection
+        st.session_state.app.selected_causes = final_selection
 
         # -----------------------------------------------------------
         # NEW: Add the user's explicit selection to the chat history
         # -----------------------------------------------------------
-        selected_causes_text = ", ".join(st.session_state.selected_causes)
+        selected_causes_text = ", ".join(st.session_state.app.selected_causes)
         
         # Log the user's action *before* the bot responds
         update_chat("user", f"I have confirmed the diagnosis. The likely root causes are: **{selected_causes_text}**")
@@ -588,102 +1022,98 @@ elif st.session_state.step == 3:
         final_case_summary = run_with_progress(
             "Generating final case summary using user-confirmed causes...",
             refine_problem_statement_with_causes,
-            st.session_state.problem_statement,
-            st.session_state.selected_causes
+            st.session_state.app.problem_statement,
+            st.session_state.app.selected_causes
         )
-        st.session_state.problem_statement = final_case_summary
+        st.session_state.app.problem_statement = final_case_summary
         
         # 3. **NEW:** Generate Comprehensive Suggested Actions
-        comprehensive_action = generate_comprehensive_action_summary(st.session_state.selected_causes)
-        st.session_state.suggested_action = comprehensive_action
+        comprehensive_action = generate_comprehensive_action_summary(tuple(st.session_state.app.selected_causes))
+        st.session_state.app.suggested_action = comprehensive_action
         
         # 4. Update chat history with the FINAL summary and action
         update_chat("assistant", 
             f"**✅ Diagnosis Complete!** Here is the final information before you try the fix:\n\n"
-            f"**Final Case Summary:** \n> {st.session_state.problem_statement}\n\n"
-            f"**Confirmed Causes:** {', '.join(st.session_state.selected_causes)}\n\n"
-            f"**Suggested Actions (Covering ALL Confirmed Causes):**\n\n{st.session_state.suggested_action}\n\n" # st.session_state.suggested_action now contains '\n\n' separators
+            f"**Final Case Summary:** \n> {st.session_state.app.problem_statement}\n\n"
+            f"**Confirmed Causes:** {selected_causes_text}\n\n"
+            f"**Suggested Actions (Covering ALL Confirmed Causes):**\n\n{st.session_state.app.suggested_action}\n\n" # st.session_state.app.suggested_action now contains '\n\n' separators
             f"**Please try the suggested action(s) now and let me know the result.**"
         )
-        st.session_state.step = 3.5 # Move to the resolution check
+        st.session_state.app.step = 3.5 # Move to the resolution check
         st.rerun()
 
-elif st.session_state.step == 3.5:
+# Radio labels for the Step 3.5 resolution form.
+_RESOLVED_LABEL = "✅ Yes, the issue is resolved!"
+_ESCALATE_LABEL = "❌ No, the issue persists. Create a case."
+
+def _on_resolved():
+    """Records a resolved outcome; runs before the natural rerun."""
+    append_turn(
+        "The suggested action worked! My issue is now resolved.",
+        "Fantastic news! We're glad the issue was resolved without needing a human agent. Happy printing/computing! This chat is now closed.",
+    )
+    st.session_state.app.resolved = True
+    st.session_state.app.step = 5
+
+def _on_escalate():
+    """Records an unresolved outcome; moves on to case creation."""
+    append_turn(
+        "The suggested action did not fix the problem. The issue still persists.",
+        "I'm sorry the issue persists. Since the initial fix didn't work, we'll proceed immediately to creating a formal support case. Please fill out the form below.",
+    )
+    st.session_state.app.step = 4
+
+def _on_resolution():
+    """Form-submit callback: dispatches on the resolution radio choice."""
+    if st.session_state.resolution_choice == _RESOLVED_LABEL:
+        _on_resolved()
+    else:
+        _on_escalate()
+
+def render_resolution_check():
     # --- Step 3.5: Resolution Check ---
     st.subheader("Step 3.5: Did the Suggested Action Work? 🤔")
     st.markdown("We have provided a detailed summary and the suggested action above. **Please attempt that action now.**")
-    
+
     # Show key details for quick reference
-    st.info(f"**Action to Try:** \n\n{st.session_state.suggested_action}")
-    
+    st.info(f"**Action to Try:** \n\n{st.session_state.app.suggested_action}")
+
     st.markdown("Once you've tried the action, please let us know the outcome:")
-    
-    col_yes, col_no = st.columns(2)
-    
-    # RESOLVED (Moves to Step 5: Finished) - Set type="primary" (Green/Success)
-    # ----------------------------------------------------
-    # YES Button (Green - SUCCESS)
-    # ----------------------------------------------------
-    with col_yes:
-        with stylable_container(
-            key="green_button",
-            css_styles="""
-                button {
-                    background-color: #28a745; /* Bootstrap Green */
-                    color: white;
-                    border-color: #28a745;
-                }
-                button:hover {
-                    background-color: #218838; /* Slightly darker on hover */
-                    border-color: #218838;
-                }
-            """
-        ):
-            if st.button("✅ Yes, the issue is resolved!", use_container_width=True):
-                # Log User's Action
-                update_chat("user", "The suggested action worked! My issue is now resolved.")
-                # Bot's Success Message
-                update_chat("assistant", "Fantastic news! We're glad the issue was resolved without needing a human agent. Happy printing/computing! This chat is now closed.")
-                st.session_state.step = 5
-                st.rerun()
-        
-    # NOT RESOLVED (Moves to Step 4: Case Creation)
-    # ----------------------------------------------------
-    # NO Button (Red - ESCALATE)
-    # ----------------------------------------------------
-    with col_no:
-        with stylable_container(
-            key="red_button",
-            css_styles="""
-                button {
-                    background-color: #dc3545; /* Bootstrap Red */
-                    color: white;
-                    border-color: #dc3545;
-                }
-                button:hover {
-                    background-color: #c82333; /* Slightly darker on hover */
-                    border-color: #c82333;
-                }
-            """
-        ):
-            if st.button("❌ No, the issue persists. Create a case.", use_container_width=True):
-                # Log User's Action
-                update_chat("user", "The suggested action did not fix the problem. The issue still persists.")
-                # Bot's Escalation Message
-                update_chat("assistant", "I'm sorry the issue persists. Since the initial fix didn't work, we'll proceed immediately to creating a formal support case. Please fill out the form below.")
-                st.session_state.step = 4
-                st.rerun()
-
-elif st.session_state.step == 4:
+
+    # One form instead of two independent buttons: choosing an option is
+    # batched with the submit click into a single rerun, and the on_click
+    # callback runs before that rerun, so each outcome costs one script pass.
+    with st.form("resolution_form"):
+        st.radio(
+            "Did the suggested action resolve your issue?",
+            (_RESOLVED_LABEL, _ESCALATE_LABEL),
+            horizontal=True,
+            key="resolution_choice",
+        )
+        st.form_submit_button("Submit Outcome", type="primary", on_click=_on_resolution)
+
+@st.cache_data(show_spinner=False)
+def _form_options(suggested_cause: str) -> tuple:
+    """Sorted cause options, with the bot's suggestion merged in should it
+    ever not be a known cause. Cached process-wide instead of per session:
+    the result depends only on the suggestion, not on who is asking.
+    """
+    if suggested_cause and suggested_cause not in COMMON_CAUSES_SORTED:
+        return tuple(sorted(set(COMMON_CAUSES_SORTED) | {suggested_cause}))
+    return COMMON_CAUSES_SORTED
+
+@st.fragment
+def render_case_form():
     # --- Step 4: Case Creation Form ---
+    # Fragment: widget interaction inside the form reruns only this block,
+    # not the whole script. The submit handler requests an app-scoped rerun
+    # so the Step 5 view and sidebar update after a successful submission.
     st.subheader("Step 4: Create a Support Case")
     st.markdown("The suggested action has been provided. If the issue persists, please submit the following form to create a formal case with our support team.")
 
     validation_placeholder = st.empty()
 
-    # The options list is simply all known causes.
-    # We sort the list for consistent display. The "Uncategorized" cause will now be included.
-    options_list = sorted(list(COMMON_CAUSES))
+    options_list = _form_options(st.session_state.app.suggested_cause)
 
     with st.form("case_creation_form"):
         col1, col2 = st.columns(2)
@@ -700,7 +1130,7 @@ elif st.session_state.step == 4:
         st.caption("Final Problem Statement (Refined by the chat):")
         final_statement = st.text_area(
             "**Final Refined Case Summary** (Generated based on your confirmed causes):",
-            value=st.session_state.problem_statement,
+            value=st.session_state.app.problem_statement,
             height=150,
             disabled=True
         )
@@ -708,12 +1138,12 @@ elif st.session_state.step == 4:
         st.caption("Confirmed Root Causes:")
         st.multiselect(
             "Selected Causes",
-            options=COMMON_CAUSES,
-            default=st.session_state.selected_causes,
+            options=options_list,
+            default=st.session_state.app.selected_causes,
             disabled=True
         )
         
-        st.info(f"**Bot Identified Cause:** {st.session_state.suggested_cause}")
+        st.info(f"**Bot Identified Cause:** {st.session_state.app.suggested_cause}")
 
         # Submission Button
         submit_case = st.form_submit_button(
@@ -725,43 +1155,52 @@ elif st.session_state.step == 4:
     # Validation logic runs ONLY after the button is clicked
     if submit_case:
         
-        required_inputs = {
-            "Full Name": name,
-            "Email Address": email,
-            "Product Model / Device Name": product_model,
-        }
-        missing_fields = []
-        
-        for label, value in required_inputs.items():
-            # Check if the value is empty or contains only whitespace
-            if not value or not value.strip():
-                missing_fields.append(label)
+        # A field is missing if empty or all whitespace; str.isspace is a
+        # C-level predicate, so no stripped copies are allocated per check.
+        missing_fields = [
+            label
+            for label, key in REQUIRED_CASE_FIELDS
+            if not st.session_state[key] or st.session_state[key].isspace()
+        ]
+
+        # Cheap sanity check on the email format — a character membership test,
+        # no regex needed for obviously malformed input.
+        if email and not email.isspace() and "@" not in email:
+            missing_fields.append("Email Address (invalid format)")
 
         if missing_fields:
-            # If fields are missing, display the error message in the placeholder
-            error_message = f"**⚠️ Please fill in all required fields to submit the case.** Missing: {', '.join(missing_fields)}"
-            validation_placeholder.error(error_message)
+            _report_missing_fields(validation_placeholder, missing_fields)
         else:
-            # If the form is valid, clear any previous error and submit the case
-            validation_placeholder.empty()
-            form_data = {
-                'name': name,
-                'email': email,
-                'phone': phone,
-                'product_model': product_model,
-                'problem_statement': final_statement,
-                'selected_causes': st.session_state.selected_causes,
-                'suggested_cause': st.session_state.suggested_cause
-            }
-            # This will update the chat history and rerender the final step (Step 5)
-            handle_case_submission(form_data)
+            _submit_case_form(validation_placeholder, name, email, phone, product_model, final_statement)
 
-elif st.session_state.step == 5:
+def render_finished():
     # --- Step 5: Finished/Reset ---
     
-    if "resolved" in st.session_state.chat_history[-1]["content"].lower():
+    # The outcome is recorded as a flag when the user clicks YES/NO on Step
+    # 3.5, so no lowercased scan of the last chat message is needed here.
+    if st.session_state.app.resolved:
         st.success("🎉 Issue Resolved! The chat is closed. Click 'Start New Chat' in the sidebar for a new issue.")
     else:
         st.info("The case has been finalized. Please start a new chat if you have another issue.")
         
-    st.chat_input("Chat is finished. Click 'Start New Chat' in the sidebar.", disabled=True)
\ No newline at end of file
+    # A static styled bar instead of a disabled st.chat_input: same visual cue
+    # without registering and diffing a real widget on every Step 5 rerun.
+    st.markdown(
+        "<div style='border:1px solid rgba(49,51,63,0.2); border-radius:0.5rem; "
+        "padding:0.75rem 1rem; color:rgba(49,51,63,0.4);'>"
+        "Chat is finished. Click 'Start New Chat' in the sidebar.</div>",
+        unsafe_allow_html=True,
+    )
+
+# O(1) dispatch to the active step's view; the chat fragment above handles the
+# conversational steps (1/1.5/2/2.5) itself, so those map to no extra view.
+STEP_VIEWS = {
+    3: render_diagnosis_confirmation,
+    3.5: render_resolution_check,
+    4: render_case_form,
+    5: render_finished,
+}
+
+_step_view = STEP_VIEWS.get(st.session_state.app.step)
+if _step_view:
+    _step_view()
\ No newline at end of file